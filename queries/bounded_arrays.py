@@ -0,0 +1,216 @@
+import statistics
+import time
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from read_layer import find_embedded
+
+# Outlier / overflow pattern for the embedded arrays that keep growing (customers.currentOrders,
+# partners.deliveryTasks). With a cap set, a parent never holds more than `cap` elements: once full,
+# the oldest elements are moved to a companion overflow document (one bucket per spill,
+# {"parentID", "field", "items", "count"}) so that `cap - spill` remain, and the new element is pushed
+# with $push + $slice. A full array spills `spill` elements, one already over the cap spills the excess too.
+# The parent keeps `<field>Overflow`, the number of its elements living in overflow buckets, so
+# readers only query the overflow collection for parents that actually spilled.
+# With the cap unset (the default) pushes are plain $push, exactly like before.
+
+CUSTOMER_ORDERS = {"collection": "customers", "field": "currentOrders", "overflow": "customers_overflow"}
+PARTNER_TASKS = {"collection": "partners", "field": "deliveryTasks", "overflow": "partners_overflow"}
+
+BOUNDED_ARRAYS = {"cap": None, "spill": None}
+
+# Concurrent pushes/pulls on the same parent make the spill update miss, it is then simply retried
+MAX_SPILL_RETRIES = 5
+
+def set_array_cap(cap, spill=None):
+    if cap is not None and cap < 2:
+        raise ValueError("The array cap must be at least 2")
+    if cap is not None and spill is not None and not 1 <= spill < cap:
+        raise ValueError("The spill size must be between 1 and cap - 1")
+    BOUNDED_ARRAYS["cap"] = cap
+    # Spilling half of the array at once keeps the slow path to one in every cap/2 pushes
+    BOUNDED_ARRAYS["spill"] = spill or (cap // 2 if cap else None)
+
+def overflow_field(spec):
+    return f"{spec['field']}Overflow"
+
+def ensure_overflow_indexes(db, spec):
+    db[spec["overflow"]].create_index([("parentID", 1), ("_id", 1)])
+
+
+# ---------------- WRITES ---------------- #
+
+def push_embedded(db, spec, parent_id, item):
+    cap, spill = BOUNDED_ARRAYS["cap"], BOUNDED_ARRAYS["spill"]
+    parents, field = db[spec["collection"]], spec["field"]
+    if cap is None:
+        return parents.update_one({"_id": parent_id}, {"$push": {field: item}}).matched_count > 0
+
+    # Fast path: the array still has room (no element at index cap-1)
+    result = parents.update_one(
+        {"_id": parent_id, f"{field}.{cap - 1}": {"$exists": False}},
+        {"$push": {field: item}}
+    )
+    if result.matched_count:
+        return True
+
+    ensure_overflow_indexes(db, spec)
+    # After the spill the parent keeps its newest `keep` elements plus the new one. The array may already
+    # be longer than the cap (cap enabled over existing data, or lowered): everything older goes too.
+    keep = cap - spill
+    for _ in range(MAX_SPILL_RETRIES):
+        # Current length and the elements to move, in one round trip
+        parent = next(parents.aggregate([
+            {"$match": {"_id": parent_id}},
+            {"$project": {"_id": 0, "state": {"$let": {
+                "vars": {"items": {"$ifNull": [f"${field}", []]}},
+                "in": {"length": {"$size": "$$items"},
+                       "oldest": {"$slice": ["$$items", {"$max": [{"$subtract": [{"$size": "$$items"}, keep]}, 1]}]}}
+            }}}}
+        ]), None)
+        if parent is None:
+            return False
+        length, oldest = parent["state"]["length"], parent["state"]["oldest"]
+        if length < cap:
+            # Emptied meanwhile (i.e. archival), the fast path works again
+            result = parents.update_one(
+                {"_id": parent_id, f"{field}.{cap - 1}": {"$exists": False}},
+                {"$push": {field: item}}
+            )
+            if result.matched_count:
+                return True
+            continue
+
+        # Copy the oldest elements out first, so nothing is lost if we crash before the parent update
+        bucket_id = ObjectId()
+        db[spec["overflow"]].insert_one({"_id": bucket_id, "parentID": parent_id, "field": field,
+                                         "items": oldest, "count": len(oldest)})
+
+        # Only slice if the array still has the length we read and starts with the elements we copied
+        result = parents.update_one(
+            {"_id": parent_id,
+             f"{field}.0._id": oldest[0]["_id"],
+             f"{field}.{len(oldest) - 1}._id": oldest[-1]["_id"],
+             f"{field}.{length - 1}": {"$exists": True},
+             f"{field}.{length}": {"$exists": False}},
+            {"$push": {field: {"$each": [item], "$slice": -(keep + 1)}},
+             "$inc": {overflow_field(spec): len(oldest)}}
+        )
+        if result.matched_count:
+            return True
+        # Lost a race: drop the copy and try again with fresh data
+        db[spec["overflow"]].delete_one({"_id": bucket_id})
+    raise RuntimeError(f"Could not spill {field} of {parent_id} after {MAX_SPILL_RETRIES} attempts")
+
+def pull_embedded(db, spec, parent_id, query, overflow_matches=0, update=None):
+    # $pull matching elements from the parent and from its overflow buckets, `update` is merged into the
+    # parent update. `overflow_matches` is how many of them read_embedded found in the buckets: the
+    # buckets are only touched when it is non-zero, but the counter moves by what was actually removed
+    # (elements may have been spilled or changed since the read).
+    update = dict(update or {})
+    update["$pull"] = {spec["field"]: query}
+    if overflow_matches:
+        removed = _pull_overflow(db, spec, parent_id, query)
+        if removed:
+            update["$inc"] = {overflow_field(spec): -removed}
+    return db[spec["collection"]].update_one({"_id": parent_id}, update)
+
+def _pull_overflow(db, spec, parent_id, query):
+    # Bucket by bucket, so each one reports how many items it lost in the same atomic update
+    overflow = db[spec["overflow"]]
+    removed = 0
+    for bucket in list(overflow.find({"parentID": parent_id, "field": spec["field"],
+                                      "items": {"$elemMatch": query}}, {"_id": 1})):
+        result = overflow.find_one_and_update(
+            {"_id": bucket["_id"]},
+            [{"$set": {"items": {"$filter": {"input": "$items", "as": "item",
+                                             "cond": {"$not": [_as_expression(query)]}}}}},
+             # "$count" is still the value before this update here
+             {"$set": {"lastPulled": {"$subtract": ["$count", {"$size": "$items"}]}, "count": {"$size": "$items"}}}],
+            projection={"lastPulled": 1, "count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if result is not None:
+            removed += result["lastPulled"]
+    overflow.delete_many({"parentID": parent_id, "count": 0})
+    return removed
+
+def _as_expression(query):
+    # Turn the small {"key": value} / {"key": {"$in": [...]}} queries used by the archival functions
+    # into the equivalent aggregation expression on "$$item", for the pipeline update above
+    conditions = []
+    for key, value in query.items():
+        if isinstance(value, dict) and "$in" in value:
+            conditions.append({"$in": [f"$$item.{key}", value["$in"]]})
+        else:
+            conditions.append({"$eq": [f"$$item.{key}", value]})
+    return {"$and": conditions}
+
+
+# ---------------- READS ---------------- #
+
+def read_embedded(db, spec, parent_filter, query, fields=(), label=None):
+    # Elements matching `query` from the parent array and, if it spilled, from its overflow buckets
+    # (oldest first, like the array itself). Returns (parent, items, number of items found in overflow).
+    field = spec["field"]
+    parent = find_embedded(db, spec["collection"], parent_filter, field, _as_expression(query),
+                           fields=tuple(fields) + (overflow_field(spec),), label=label)
+    if parent is None:
+        return None, [], 0
+
+    overflow_items = []
+    if parent.get(overflow_field(spec)):
+        overflow_items = [bucket["item"] for bucket in db[spec["overflow"]].aggregate([
+            {"$match": {"parentID": parent["_id"], "field": field}},
+            {"$sort": {"_id": 1}},
+            {"$unwind": "$items"},
+            {"$match": {f"items.{key}": value for key, value in query.items()}},
+            {"$project": {"_id": 0, "item": "$items"}}
+        ])]
+    return parent, overflow_items + list(parent[field]), len(overflow_items)
+
+
+# ---------------- BENCHMARK ---------------- #
+
+def benchmark_bounded_arrays(db, caps=(None, 50), pushes=2000, item_size=20):
+    # Pushes `pushes` order-like elements into a scratch parent for every cap and reports the
+    # parent's final BSON size and the push latency. Only touches the bench_* collections.
+    spec = {"collection": "bench_parents", "field": "currentOrders", "overflow": "bench_parents_overflow"}
+    previous = dict(BOUNDED_ARRAYS)
+    results = []
+    try:
+        for cap in caps:
+            db[spec["collection"]].drop()
+            db[spec["overflow"]].drop()
+            set_array_cap(cap)
+            db[spec["collection"]].insert_one({"_id": "bench", spec["field"]: []})
+
+            latencies = []
+            for i in range(pushes):
+                item = {"_id": ObjectId(), "totalOrderCost": i, "status": "Pending",
+                        "orderItems": [{"productID": str(ObjectId()), "quantity": 1} for _ in range(item_size)]}
+                started = time.perf_counter()
+                push_embedded(db, spec, "bench", item)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            size = next(db[spec["collection"]].aggregate([
+                {"$match": {"_id": "bench"}},
+                {"$project": {"size": {"$bsonSize": "$$ROOT"}}}
+            ]))["size"]
+            in_push_order = list(latencies)
+            latencies.sort()
+            results.append({
+                "cap": cap,
+                "parent_bytes": size,
+                "overflow_buckets": db[spec["overflow"]].count_documents({}),
+                "push_ms_median": statistics.median(latencies),
+                "push_ms_p99": latencies[int(len(latencies) * 0.99) - 1],
+                # Latency of the last pushes, where an uncapped document is at its largest
+                "push_ms_last_10pct": statistics.mean(in_push_order[-max(pushes // 10, 1):]),
+            })
+    finally:
+        BOUNDED_ARRAYS.update(previous)
+        db[spec["collection"]].drop()
+        db[spec["overflow"]].drop()
+    return results
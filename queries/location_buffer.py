@@ -0,0 +1,144 @@
+import datetime
+import threading
+import time
+
+from pymongo import UpdateOne
+
+# Drivers ping their GPS position every few seconds. Writing each ping straight into partners.location
+# means one 2dsphere index update per ping, while dispatch (assign_order_and_partner) only ever needs
+# the latest point. The buffer keeps the newest ping per partner in memory and writes all of them as
+# one unordered bulk_write every `flush_interval` seconds, so a partner costs at most one index update
+# per interval however often they ping, and a location is never more than about one interval old.
+
+class PartnerLocationBuffer:
+
+    def __init__(self, db, flush_interval=2.0, max_pending=100000):
+        self.db = db
+        self.flush_interval = flush_interval
+        # Backpressure threshold: distinct partners waiting to be written
+        self.max_pending = max_pending
+
+        self._pending = {}  # partner_id -> (lon, lat, ping time, received at)
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._flush_now = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._metrics = {
+            "pings_received": 0,
+            "pings_coalesced": 0,  # pings overwritten by a newer one before being written
+            "pings_out_of_order": 0,  # pings older than the one already buffered
+            "pings_rejected": 0,  # backpressure timeouts
+            "flushes": 0,
+            "writes": 0,
+            "write_errors": 0,
+            "last_flush_seconds": 0.0,
+            "last_flush_lag_seconds": 0.0,  # age of the oldest ping when its flush completed
+            "max_flush_lag_seconds": 0.0,
+        }
+
+    # ---------------- INGESTION ---------------- #
+
+    def submit(self, partner_id, lon, lat, timestamp=None, block=True, timeout=None):
+        timestamp = timestamp or datetime.datetime.now()
+        with self._lock:
+            self._metrics["pings_received"] += 1
+            current = self._pending.get(partner_id)
+            if current is not None:
+                if timestamp < current[2]:
+                    self._metrics["pings_out_of_order"] += 1
+                    return True
+                # Only the latest point matters for dispatch, keep the first arrival time for the lag metrics
+                self._pending[partner_id] = (lon, lat, timestamp, current[3])
+                self._metrics["pings_coalesced"] += 1
+                return True
+
+            if len(self._pending) >= self.max_pending:
+                # Full: ask for an early flush and wait for it (or refuse straight away)
+                self._flush_now.set()
+                if not block or not self._space.wait_for(lambda: len(self._pending) < self.max_pending, timeout):
+                    self._metrics["pings_rejected"] += 1
+                    return False
+            self._pending[partner_id] = (lon, lat, timestamp, time.monotonic())
+            return True
+
+    # ---------------- FLUSHING ---------------- #
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._space.notify_all()
+        if not batch:
+            return 0
+
+        started = time.monotonic()
+        requests = [
+            UpdateOne(
+                # Never let a delayed flush overwrite a newer location written by someone else
+                {"_id": partner_id, "$or": [{"locationUpdatedAt": {"$lt": timestamp}},
+                                            {"locationUpdatedAt": {"$exists": False}}]},
+                {"$set": {"location": {"type": "Point", "coordinates": [lon, lat]}, "locationUpdatedAt": timestamp}}
+            ) for partner_id, (lon, lat, timestamp, _) in batch.items()
+        ]
+        try:
+            self.db.partners.bulk_write(requests, ordered=False)
+        except Exception as e:
+            print("Partner location flush failed: ", e)
+            self._requeue(batch)
+            with self._lock:
+                self._metrics["write_errors"] += 1
+            return 0
+
+        finished = time.monotonic()
+        oldest = min(received for (_, _, _, received) in batch.values())
+        with self._lock:
+            self._metrics["flushes"] += 1
+            self._metrics["writes"] += len(requests)
+            self._metrics["last_flush_seconds"] = finished - started
+            self._metrics["last_flush_lag_seconds"] = finished - oldest
+            self._metrics["max_flush_lag_seconds"] = max(self._metrics["max_flush_lag_seconds"], finished - oldest)
+        return len(requests)
+
+    def _requeue(self, batch):
+        # Put a failed batch back, unless newer pings for the same partners arrived meanwhile
+        with self._lock:
+            for partner_id, ping in batch.items():
+                if partner_id not in self._pending:
+                    self._pending[partner_id] = ping
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            self.flush()
+
+    def start(self):
+        self.db.partners.create_index([("location", "2dsphere")])
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partner-location-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._flush_now.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Whatever arrived after the last interval
+        self.flush()
+
+    # ---------------- METRICS ---------------- #
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pending"] = len(self._pending)
+            metrics["backpressure"] = len(self._pending) / self.max_pending
+            # Age of the oldest ping not written yet, i.e. the current dispatch staleness bound
+            metrics["current_lag_seconds"] = max((now - received for (_, _, _, received) in self._pending.values()), default=0.0)
+        # How many index updates the coalescing saved compared to one update_one per ping
+        metrics["write_reduction"] = metrics["pings_received"] / max(metrics["writes"], 1)
+        return metrics
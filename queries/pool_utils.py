@@ -0,0 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
+
+def process_pool(processes=None, initializer=None, initargs=()):
+    # Workers only receive already fetched data, nothing they need is inherited from the parent, so the
+    # platform's default start method is fine. queries.py connects and resets the DB only under
+    # __main__, so spawn/forkserver workers (that re-import it as __mp_main__) never touch the server.
+    return ProcessPoolExecutor(max_workers=processes, initializer=initializer, initargs=initargs)
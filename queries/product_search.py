@@ -0,0 +1,451 @@
+import bisect
+import heapq
+import re
+import statistics
+import threading
+import time
+
+# In-memory inverted index over the products catalog for storefront search.
+#
+# Every product is tokenized per field (name, description, category, origin, type and the
+# type-specific author / artist / brand / publisher / model attributes), each field with its own weight.
+# A query matches products containing all of its terms; the last term also matches as a prefix
+# (search-as-you-type) and a term with no hit at all falls back to terms one edit away (typos), found
+# through a deletion neighbourhood instead of comparing against the whole vocabulary.
+# Results are ranked by field weight * idf, boosted by avgRatingScore, and come with facet counts
+# per productSegment / productType / category.
+#
+# Broad single-word queries (the common storefront case) never touch their whole posting lists: every
+# term keeps a list of its products in rank order (built on first use, then kept sorted in place on
+# every change) plus running facet counts, so the top hits are a merge of a few sorted lists.
+# Multi-word queries walk the rarest term and probe the others.
+#
+# The index is kept current from a change stream on products (see ProductIndexWatcher), so it only
+# needs a full build at start-up. Updates and searches take the index lock: the watcher thread applies
+# changes while other threads search.
+
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "author": 2.0,
+    "artist": 2.0,
+    "brand": 2.0,
+    "model": 1.5,
+    "publisher": 1.0,
+    "category": 1.5,
+    "productType": 1.5,
+    "countryOfOrigin": 1.0,
+    "shortDescription": 1.0,
+}
+
+# Prefix / typo matches count less than the exact term
+PREFIX_FACTOR = 0.7
+TYPO_FACTOR = 0.5
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 64
+MIN_TYPO_LENGTH = 4
+# Share of the score coming from the rating: a 5-star product ranks up to 50% higher
+RATING_BOOST = 0.5
+
+FACETS = ("productSegment", "productType", "category")
+
+TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+def _rank_key(entry):
+    # Ranked lists are ordered best first by score alone, product ids are not always comparable
+    return -entry[0]
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+def _within_one_edit(a, b):
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        # One substitution, or two neighbouring letters swapped
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    # One insertion
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+def product_fields(product):
+    # Searchable text per field; the type-specific attributes sit either directly under
+    # otherAttributes (mock data) or under otherAttributes.typeBasedAttributes (schema)
+    attributes = product.get("attributes") or {}
+    fresh = attributes.get("freshAttributes") or {}
+    other = attributes.get("otherAttributes") or {}
+    other = other.get("typeBasedAttributes") or other
+    book = other.get("bookAttributes") or {}
+    cd = other.get("cdAttributes") or {}
+    phone = other.get("phoneAttributes") or {}
+    appliance = other.get("applianceAttributes") or {}
+    return {
+        "name": product.get("name"),
+        "shortDescription": product.get("shortDescription"),
+        "productType": product.get("productType"),
+        "category": fresh.get("category"),
+        "countryOfOrigin": fresh.get("countryOfOrigin"),
+        "author": book.get("authorName"),
+        "publisher": book.get("publisher") or cd.get("publisher"),
+        "artist": cd.get("artistName"),
+        "brand": phone.get("brand"),
+        "model": phone.get("model") or appliance.get("style"),
+    }
+
+def product_facets(product):
+    fresh = (product.get("attributes") or {}).get("freshAttributes") or {}
+    return {
+        "productSegment": product.get("productSegment"),
+        "productType": product.get("productType"),
+        "category": fresh.get("category"),
+    }
+
+
+class ProductSearchIndex:
+
+    def __init__(self):
+        self._postings = {}  # term -> {doc: weight}
+        self._terms = []  # sorted vocabulary, for prefix ranges
+        self._deletes = {}  # term with one letter removed -> {terms}
+        self._doc_terms = {}  # doc -> {term: weight}, needed to remove / replace a product
+        self._docs = {}  # doc -> {"_id", "name", "avgRatingScore", facets...}
+        self._term_facets = {}  # term -> {facet: {value: count}}
+        self._ranked = {}  # term -> [(static score, doc)] best first, built on first use
+        # Reentrant: upsert removes the previous version of a product first
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ---------------- UPDATES ---------------- #
+
+    def upsert(self, product):
+        with self._lock:
+            self._upsert(product)
+
+    def _upsert(self, product):
+        product_id = product["_id"]
+        if product_id in self._docs:
+            self._remove(product_id)
+
+        terms = {}
+        for field, text in product_fields(product).items():
+            for term in tokenize(text):
+                terms[term] = terms.get(term, 0.0) + FIELD_WEIGHTS[field]
+        # Dampen repeated terms, a description repeating a word should not beat the name
+        terms = {term: weight ** 0.5 for term, weight in terms.items()}
+
+        doc = self._docs[product_id] = {
+            "_id": product_id,
+            "name": product.get("name"),
+            "avgRatingScore": product.get("avgRatingScore") or 0.0,
+            **product_facets(product),
+        }
+        self._doc_terms[product_id] = terms
+
+        for term, weight in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._term_facets[term] = {facet: {} for facet in FACETS}
+                bisect.insort(self._terms, term)
+                for deleted in _deletes(term):
+                    self._deletes.setdefault(deleted, set()).add(term)
+            postings[product_id] = weight
+            self._count_facets(term, doc, 1)
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                bisect.insort(ranked, (weight * self._boost(product_id), product_id), key=_rank_key)
+
+    def _count_facets(self, term, doc, delta):
+        for facet in FACETS:
+            value = doc.get(facet)
+            if value is not None:
+                counts = self._term_facets[term][facet]
+                counts[value] = counts.get(value, 0) + delta
+                if not counts[value]:
+                    del counts[value]
+
+    def _boost(self, doc):
+        return 1.0 + RATING_BOOST * self._docs[doc]["avgRatingScore"] / 5.0
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        doc = self._docs[product_id]
+        for term, weight in terms.items():
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            self._count_facets(term, doc, -1)
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                self._unrank(ranked, weight * self._boost(product_id), product_id)
+            if not postings:
+                del self._postings[term]
+                del self._term_facets[term]
+                self._ranked.pop(term, None)
+                del self._terms[bisect.bisect_left(self._terms, term)]
+                for deleted in _deletes(term):
+                    variants = self._deletes[deleted]
+                    variants.discard(term)
+                    if not variants:
+                        del self._deletes[deleted]
+        del self._docs[product_id]
+
+    @staticmethod
+    def _unrank(ranked, score, product_id):
+        # The entry has the exact score it was inserted with, only equal scores need scanning
+        i = bisect.bisect_left(ranked, -score, key=_rank_key)
+        while i < len(ranked) and ranked[i][1] != product_id:
+            i += 1
+        if i < len(ranked):
+            del ranked[i]
+
+    def apply_change(self, change):
+        # One change stream event (watch with full_document="updateLookup")
+        operation = change["operationType"]
+        if operation in ("insert", "replace", "update"):
+            if change.get("fullDocument") is not None:
+                self.upsert(change["fullDocument"])
+            else:
+                # Deleted before the lookup happened
+                self.remove(change["documentKey"]["_id"])
+        elif operation == "delete":
+            self.remove(change["documentKey"]["_id"])
+
+    # ---------------- QUERIES ---------------- #
+
+    def _expand(self, term, prefix):
+        # {matching term: factor} for one query term
+        expansions = {}
+        if term in self._postings:
+            expansions[term] = 1.0
+        if prefix and len(term) >= MIN_PREFIX_LENGTH:
+            start = bisect.bisect_left(self._terms, term)
+            for candidate in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+                if not candidate.startswith(term):
+                    break
+                expansions.setdefault(candidate, PREFIX_FACTOR)
+        if not expansions and len(term) >= MIN_TYPO_LENGTH:
+            candidates = set(self._deletes.get(term, ()))
+            for deleted in _deletes(term):
+                if deleted in self._postings:
+                    candidates.add(deleted)
+                candidates.update(self._deletes.get(deleted, ()))
+            for candidate in candidates:
+                if _within_one_edit(term, candidate):
+                    expansions[candidate] = TYPO_FACTOR
+        return expansions
+
+    def _idf(self, term):
+        return 1.0 + (len(self._docs) / len(self._postings[term])) ** 0.5
+
+    def _ranked_postings(self, term):
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            ranked = self._ranked[term] = sorted(
+                ((weight * self._boost(doc), doc) for doc, weight in self._postings[term].items()),
+                key=_rank_key)
+        return ranked
+
+    def _search_single_term(self, expansions, limit):
+        # Merge the rank-ordered lists of the expansions, only ever reading about `limit` entries of each
+        streams = [((score * self._idf(term) * factor, doc) for score, doc in self._ranked_postings(term))
+                   for term, factor in expansions.items()]
+        hits, seen = [], set()
+        for score, doc in heapq.merge(*streams, key=lambda entry: entry[0], reverse=True):
+            if doc in seen:
+                continue
+            seen.add(doc)
+            hits.append({**self._docs[doc], "score": round(score, 4)})
+            if len(hits) == limit:
+                break
+
+        facet_counts = {facet: {} for facet in FACETS}
+        for term in expansions:
+            for facet, counts in self._term_facets[term].items():
+                for value, count in counts.items():
+                    facet_counts[facet][value] = facet_counts[facet].get(value, 0) + count
+        return {
+            "hits": hits,
+            "total": sum(len(self._postings[term]) for term in expansions),
+            "facets": facet_counts,
+            # A product matching several expansions of the same prefix is counted once per expansion
+            "approximate": len(expansions) > 1,
+        }
+
+    def search(self, query, limit=10, filters=None, facets=True, max_candidates=None):
+        # max_candidates caps how many products of the rarest term are looked at (in rank order) for
+        # multi-word queries; it bounds latency for broad queries at the cost of an approximate total
+        with self._lock:
+            return self._search(query, limit, filters, facets, max_candidates)
+
+    def _search(self, query, limit, filters, facets, max_candidates):
+        terms = tokenize(query)
+        if not terms:
+            return {"hits": [], "total": 0, "facets": {}, "approximate": False}
+
+        # A repeated word counts once, the last distinct word is the one being typed
+        terms = list(dict.fromkeys(terms))
+        per_term = []
+        for i, term in enumerate(terms):
+            expansions = self._expand(term, prefix=(i == len(terms) - 1))
+            if not expansions:
+                return {"hits": [], "total": 0, "facets": {}, "approximate": False}
+            per_term.append({term: (factor, self._idf(term)) for term, factor in expansions.items()})
+
+        if len(per_term) == 1 and not filters:
+            return self._search_single_term({term: factor for term, (factor, _) in per_term[0].items()}, limit)
+
+        # AND across the query terms: walk the rarest one in rank order, probe the postings of the others
+        per_term.sort(key=lambda expansions: sum(len(self._postings[term]) for term in expansions))
+        rarest, others = per_term[0], per_term[1:]
+        other_postings = [[(self._postings[term], factor * idf) for term, (factor, idf) in expansions.items()]
+                          for expansions in others]
+        # Most the other terms can still add to any product (ranked entries include the rating boost)
+        other_max = sum(max(self._ranked_postings(term)[0][0] * factor * idf for term, (factor, idf) in expansions.items())
+                        for expansions in others)
+        streams = [((score * idf * factor, doc) for score, doc in self._ranked_postings(term))
+                   for term, (factor, idf) in rarest.items()]
+
+        top, seen, total, stopped_early = [], set(), 0, False
+        facet_counts = {facet: {} for facet in FACETS} if facets else {}
+        for score, doc in heapq.merge(*streams, key=lambda entry: entry[0], reverse=True):
+            # Without facets nothing below can make it into the top hits any more
+            if not facets and len(top) == limit and score + other_max <= top[0][0]:
+                stopped_early = True
+                break
+            if max_candidates is not None and len(seen) >= max_candidates:
+                stopped_early = True
+                break
+            if doc in seen:
+                continue
+            seen.add(doc)
+            info = self._docs[doc]
+            if filters and any(info.get(facet) != value for facet, value in filters.items()):
+                continue
+
+            boost = self._boost(doc)
+            for postings in other_postings:
+                best = max((term_postings[doc] * scale for term_postings, scale in postings if doc in term_postings),
+                           default=None)
+                if best is None:
+                    break
+                score += best * boost
+            else:
+                total += 1
+                for facet in facet_counts:
+                    value = info.get(facet)
+                    if value is not None:
+                        facet_counts[facet][value] = facet_counts[facet].get(value, 0) + 1
+                # The running total breaks score ties, product ids are not always comparable
+                if len(top) < limit:
+                    heapq.heappush(top, (score, -total, doc))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, -total, doc))
+
+        top.sort(reverse=True)
+        return {
+            "hits": [{**self._docs[doc], "score": round(score, 4)} for score, _, doc in top],
+            # Stopping early means the total only counts the products looked at
+            "total": total,
+            "facets": facet_counts,
+            "approximate": stopped_early,
+        }
+
+
+# ---------------- BUILDING / SYNC ---------------- #
+
+SEARCH_PROJECTION = {"name": 1, "shortDescription": 1, "productSegment": 1, "productType": 1,
+                     "avgRatingScore": 1, "attributes.freshAttributes": 1, "attributes.otherAttributes": 1}
+
+def build_product_index(db, batch_size=5000):
+    index = ProductSearchIndex()
+    for product in db.products.find({}, SEARCH_PROJECTION, batch_size=batch_size):
+        index.upsert(product)
+    return index
+
+def open_products_stream(db, resume_after=None):
+    return db.products.watch(full_document="updateLookup", resume_after=resume_after)
+
+def watch_products(db, index, stop_event=None, resume_after=None, stream=None):
+    # Apply products changes to the index until stop_event is set; returns the resume token so a
+    # restarted watcher can continue where this one stopped. Needs a replica set (change streams).
+    # Pass a `stream` opened before build_product_index to replay the writes made during the build.
+    with stream or open_products_stream(db, resume_after) as stream:
+        while stop_event is None or not stop_event.is_set():
+            change = stream.try_next()
+            if change is None:
+                time.sleep(0.05)
+                continue
+            index.apply_change(change)
+        return stream.resume_token
+
+class ProductIndexWatcher:
+    # Runs watch_products in a background thread. An error (i.e. the stream is lost) stops the thread
+    # and leaves the index stale: it is printed and kept in `error`, check healthy() before trusting it.
+
+    def __init__(self, db, index, stream=None):
+        self.db = db
+        self.index = index
+        self.error = None
+        self.resume_token = None
+        self._stream = stream
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        try:
+            self.resume_token = watch_products(self.db, self.index, self._stop, stream=self._stream)
+        except Exception as e:
+            self.error = e
+            print("Product search watcher stopped, the index is no longer updated: ", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="product-search-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def healthy(self):
+        return self.error is None and self._thread is not None and self._thread.is_alive()
+
+
+# ---------------- BENCHMARK ---------------- #
+
+def benchmark_search(index, queries, repeat=100, limit=10, **search_options):
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, limit=limit, **search_options)
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "documents": len(index),
+        "queries": len(latencies),
+        "ms_median": statistics.median(latencies),
+        "ms_p99": latencies[max(int(len(latencies) * 0.99) - 1, 0)],
+    }
@@ -0,0 +1,111 @@
+import time
+from collections import deque
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+# Thin read layer for the hot paths: always project down to the fields a caller needs and return
+# RawBSONDocuments, which keep the server's bytes and only decode a (sub)document when it is accessed.
+# Every call appends an entry to READ_STATS so the saving can be checked as documents grow.
+
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+READ_STATS = deque(maxlen=10000)
+
+# When enabled, each call also asks the server for the full document size ($bsonSize) and times decoding,
+# which costs an extra round trip: meant for diagnosis, not for production traffic.
+MEASURE = {"enabled": False}
+
+def set_measurement(enabled):
+    MEASURE["enabled"] = enabled
+
+def _projection(fields):
+    projection = {field: 1 for field in fields}
+    if "_id" not in projection:
+        projection["_id"] = 0
+    return projection
+
+def _full_size(collection, filter, limit):
+    # Size of the full documents the read matched ($limit 0 = all of them)
+    pipeline = [{"$match": filter}]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$group": {"_id": None, "size": {"$sum": {"$bsonSize": "$$ROOT"}}}})
+    result = list(collection.aggregate(pipeline))
+    return result[0]["size"] if result else None
+
+def _record(label, collection, filter, raw_docs, started, limit=1):
+    # One entry per call, whatever the number of documents it returned
+    fetch_seconds = time.perf_counter() - started
+    entry = {
+        "label": label,
+        "collection": collection.name,
+        "documents": len(raw_docs),
+        "bytes": sum(len(raw_doc.raw) for raw_doc in raw_docs),
+        "fetch_seconds": fetch_seconds,
+        "full_bytes": None,
+        "bytes_saved": None,
+        "decode_seconds_saved_estimate": None,
+    }
+    if MEASURE["enabled"] and raw_docs:
+        full_bytes = _full_size(collection, filter, limit)
+        if full_bytes:
+            # Not measured: decode cost grows roughly linearly with size, so the time the projected bytes
+            # take to decode is scaled up to what an eager decode of the full documents would have cost
+            decode_started = time.perf_counter()
+            for raw_doc in raw_docs:
+                bson.decode(raw_doc.raw)
+            projected_seconds = time.perf_counter() - decode_started
+            full_seconds = projected_seconds * full_bytes / max(entry["bytes"], 1)
+            entry["full_bytes"] = full_bytes
+            entry["bytes_saved"] = full_bytes - entry["bytes"]
+            entry["decode_seconds_saved_estimate"] = full_seconds - projected_seconds
+    READ_STATS.append(entry)
+    return entry
+
+def find_fields(db, collection_name, filter, fields, label=None):
+    # find_one restricted to `fields` (dotted paths allowed), returned as a lazily decoded RawBSONDocument
+    collection = db[collection_name].with_options(codec_options=RAW_OPTIONS)
+    started = time.perf_counter()
+    raw_doc = collection.find_one(filter, _projection(fields))
+    _record(label or collection_name, collection, filter, [raw_doc] if raw_doc is not None else [], started)
+    return raw_doc
+
+def find_many_fields(db, collection_name, filter, fields, label=None):
+    # Same as find_fields for several documents: one round trip, one stats entry for the whole batch
+    collection = db[collection_name].with_options(codec_options=RAW_OPTIONS)
+    projection = _projection(fields)
+    projection["_id"] = 1  # needed by the callers to tell the documents apart
+    started = time.perf_counter()
+    raw_docs = list(collection.find(filter, projection))
+    _record(label or collection_name, collection, filter, raw_docs, started, limit=0)
+    return raw_docs
+
+def find_embedded(db, collection_name, filter, array_field, cond, fields=(), label=None):
+    # Fetch only the elements of an embedded array that match `cond` (an aggregation expression on "$$item"),
+    # so e.g. closed orders are read without transferring every open order next to them
+    collection = db[collection_name].with_options(codec_options=RAW_OPTIONS)
+    project = {field: 1 for field in fields}
+    project[array_field] = {"$filter": {"input": {"$ifNull": [f"${array_field}", []]}, "as": "item", "cond": cond}}
+    started = time.perf_counter()
+    result = list(collection.aggregate([
+        {"$match": filter},
+        {"$limit": 1},
+        {"$project": project}
+    ]))
+    _record(label or collection_name, collection, filter, result, started)
+    return result[0] if result else None
+
+def read_stats_summary(label=None):
+    entries = [entry for entry in READ_STATS if label is None or entry["label"] == label]
+    measured = [entry for entry in entries if entry["full_bytes"] is not None]
+    return {
+        "calls": len(entries),
+        "documents": sum(entry["documents"] for entry in entries),
+        "fetch_seconds": sum(entry["fetch_seconds"] for entry in entries),
+        "bytes_transferred": sum(entry["bytes"] for entry in entries),
+        "bytes_saved": sum(entry["bytes_saved"] for entry in measured),
+        "decode_seconds_saved_estimate": sum(entry["decode_seconds_saved_estimate"] for entry in measured),
+        "measured_calls": len(measured),
+    }
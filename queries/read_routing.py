@@ -0,0 +1,88 @@
+import statistics
+import threading
+import time
+
+from pymongo.read_preferences import SecondaryPreferred
+
+# The analytical pipelines (plots, product stats, lowest inventories, rating averages) unwind whole
+# collections. Sending them to a secondary, preferably one tagged as an analytics node, keeps that load
+# off the primary that serves order placement. Order-path functions keep using the plain `db` (primary).
+#
+# maxStalenessSeconds bounds how far behind a secondary may be to still be picked (the driver minimum is
+# 90s). When no secondary qualifies, SecondaryPreferred falls back to the primary, so standalone / dev
+# setups keep working unchanged.
+
+ANALYTICS = {
+    "enabled": True,
+    "max_staleness_seconds": 120,
+    # Analytics-tagged node first, any secondary otherwise
+    "tag_sets": [{"nodeType": "ANALYTICS"}, {}],
+    "allow_disk_use": True,
+}
+
+def configure_analytics(enabled=None, max_staleness_seconds=None, tag_sets=None, allow_disk_use=None):
+    if max_staleness_seconds is not None and max_staleness_seconds != -1 and max_staleness_seconds < 90:
+        raise ValueError("maxStalenessSeconds must be at least 90 (or -1 for no limit)")
+    for key, value in (("enabled", enabled), ("max_staleness_seconds", max_staleness_seconds),
+                       ("tag_sets", tag_sets), ("allow_disk_use", allow_disk_use)):
+        if value is not None:
+            ANALYTICS[key] = value
+
+def analytics_db(db):
+    if not ANALYTICS["enabled"]:
+        return db
+    read_preference = SecondaryPreferred(tag_sets=ANALYTICS["tag_sets"],
+                                         max_staleness=ANALYTICS["max_staleness_seconds"])
+    return db.client.get_database(db.name, read_preference=read_preference)
+
+def analytics_options():
+    # Keyword arguments for aggregate() in analytics functions
+    return {"allowDiskUse": ANALYTICS["allow_disk_use"]}
+
+
+# ---------------- VERIFICATION ---------------- #
+
+def measure_order_path(order_fn, report_fn=None, duration=30.0, report_threads=2):
+    # Calls order_fn() in a loop for `duration` seconds and reports its latency percentiles, while
+    # `report_threads` threads keep calling report_fn(). Run it once with reports routed to secondaries
+    # and once with configure_analytics(enabled=False) to compare the order-path p99. report_fn runs in
+    # several threads at once, so it must be safe to run concurrently (read-only reports).
+    stop = threading.Event()
+    report_runs = []
+    report_failures = []
+
+    def run_reports():
+        # A failing report must not end its thread: the load would silently drop during the run
+        while not stop.is_set():
+            try:
+                report_fn()
+                report_runs.append(1)
+            except Exception as e:
+                report_failures.append(repr(e))
+
+    threads = [threading.Thread(target=run_reports, daemon=True) for _ in range(report_threads if report_fn else 0)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            order_fn()
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    latencies.sort()
+    return {
+        "orders": len(latencies),
+        "reports": len(report_runs),
+        # Compare against "reports": a run where most reports failed did not put the intended load on
+        "report_failures": len(report_failures),
+        "report_errors": sorted(set(report_failures))[:5],
+        "order_ms_median": statistics.median(latencies) if latencies else None,
+        "order_ms_p99": latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else None,
+    }
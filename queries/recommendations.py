@@ -0,0 +1,242 @@
+import datetime
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from bson import json_util
+from pymongo import UpdateOne
+
+from pool_utils import process_pool
+
+# Batch job filling customers.recommendedProducts from co-purchases in past_orders.
+#
+# R is the binary customer x product matrix ("customer bought product at least once").
+# C = R^T R counts, for every pair of products, how many customers bought both; its diagonal is
+# the number of buyers of each product. Cosine item-item similarity is C scaled by 1/sqrt(diagonal)
+# on both sides. A customer's scores are their row of R times the similarity matrix.
+#
+# C is kept on disk between runs. Incremental runs only look at customers with past orders closed
+# since the last run: their old rows are subtracted from C and their new rows added, which gives
+# exactly the C a full rebuild would, and only those customers get new recommendations.
+
+STATE_NAME = "co_purchase_state"
+
+
+# ---------------- FETCHING ---------------- #
+
+def _fetch_baskets(db, match, closed_before=None):
+    # customerID -> {"all": set(productIDs), "old": set(productIDs closed before `closed_before`)}
+    baskets = {}
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, "customerID": 1, "closedAt": 1, "orderItems.productID": 1}},
+    ]
+    for order in db.past_orders.aggregate(pipeline, allowDiskUse=True):
+        basket = baskets.setdefault(order["customerID"], {"all": set(), "old": set()})
+        product_ids = {item["productID"] for item in order.get("orderItems", [])}
+        basket["all"].update(product_ids)
+        # Seed data has no closedAt, it was there before any run so it always counts as old
+        if closed_before is not None and order.get("closedAt", closed_before) <= closed_before:
+            basket["old"].update(product_ids)
+    return baskets
+
+def _changed_customers(db, since, until):
+    return db.past_orders.distinct("customerID", {"closedAt": {"$gt": since, "$lte": until}})
+
+
+# ---------------- MATRICES ---------------- #
+
+def _to_matrix(customer_ids, baskets, key, product_index):
+    rows, cols = [], []
+    for row, customer_id in enumerate(customer_ids):
+        for product_id in baskets[customer_id][key]:
+            rows.append(row)
+            cols.append(product_index[product_id])
+    data = np.ones(len(rows), dtype=np.float32)
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(customer_ids), len(product_index)))
+
+def _row_shards(matrix, shard_size):
+    return [matrix[start:start + shard_size] for start in range(0, matrix.shape[0], shard_size)]
+
+def _cooccurrence_shard(shard):
+    return (shard.T @ shard).tocsr()
+
+def _cooccurrence(matrix, pool, shard_size):
+    # Map: R_k^T R_k per shard of customers, reduce: sum, which equals R^T R
+    cooc = sp.csr_matrix((matrix.shape[1], matrix.shape[1]), dtype=np.float32)
+    for partial in pool.map(_cooccurrence_shard, _row_shards(matrix, shard_size)):
+        cooc = cooc + partial
+    return cooc
+
+def _resize(matrix, size):
+    matrix = matrix.tocoo()
+    return sp.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=(size, size))
+
+def _item_similarity(cooc, neighbours):
+    buyers = cooc.diagonal()
+    inv_norm = np.zeros_like(buyers)
+    np.divide(1.0, np.sqrt(buyers), out=inv_norm, where=buyers > 0)
+    scale = sp.diags(inv_norm)
+    similarity = (scale @ cooc @ scale).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    # Keep only the strongest neighbours of every product, so scoring stays sparse
+    indptr, indices, data = [0], [], []
+    for row in range(similarity.shape[0]):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        row_data = similarity.data[start:end]
+        row_indices = similarity.indices[start:end]
+        if len(row_data) > neighbours:
+            keep = np.argpartition(-row_data, neighbours)[:neighbours]
+            row_data, row_indices = row_data[keep], row_indices[keep]
+        indices.extend(row_indices)
+        data.extend(row_data)
+        indptr.append(len(indices))
+    return sp.csr_matrix((np.array(data, dtype=np.float32), np.array(indices, dtype=np.int64), np.array(indptr)),
+                         shape=similarity.shape)
+
+
+# ---------------- SCORING (pool workers) ---------------- #
+
+_SCORING = {}
+
+def _init_scoring(similarity, top_n):
+    _SCORING["similarity"] = similarity
+    _SCORING["top_n"] = top_n
+
+def _score_shard(shard):
+    top_n = _SCORING["top_n"]
+    scores = (shard @ _SCORING["similarity"]).tocsr()
+    results = []
+    for row in range(shard.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        row_scores = scores.data[start:end]
+        row_products = scores.indices[start:end]
+
+        # Never recommend something the customer already bought
+        bought = shard.indices[shard.indptr[row]:shard.indptr[row + 1]]
+        mask = ~np.isin(row_products, bought) & (row_scores > 0)
+        row_scores, row_products = row_scores[mask], row_products[mask]
+
+        if len(row_scores) > top_n:
+            keep = np.argpartition(-row_scores, top_n)[:top_n]
+            row_scores, row_products = row_scores[keep], row_products[keep]
+        order = np.argsort(-row_scores)
+        results.append(row_products[order].tolist())
+    return results
+
+
+# ---------------- STATE ---------------- #
+
+def _state_paths(state_dir):
+    base = os.path.join(state_dir, STATE_NAME)
+    return f"{base}.npz", f"{base}.json"
+
+def _load_state(state_dir):
+    matrix_path, meta_path = _state_paths(state_dir)
+    if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, 'r') as file:
+        meta = json_util.loads(file.read())
+    return {
+        "cooc": sp.load_npz(matrix_path).tocsr(),
+        "product_ids": meta["product_ids"],
+        "last_run": datetime.datetime.fromisoformat(meta["last_run"]),
+    }
+
+def _save_state(state_dir, cooc, product_ids, last_run):
+    os.makedirs(state_dir, exist_ok=True)
+    matrix_path, meta_path = _state_paths(state_dir)
+    # Write then rename, a crash mid-save must not leave a matrix that does not match its metadata
+    sp.save_npz(f"{matrix_path}.tmp.npz", cooc)
+    # Extended JSON, product ids may be ObjectIds (what db_schema.jsonc declares) as well as strings
+    with open(f"{meta_path}.tmp", 'w') as file:
+        file.write(json_util.dumps({"product_ids": product_ids, "last_run": last_run.isoformat()}))
+    os.replace(f"{matrix_path}.tmp.npz", matrix_path)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+# ---------------- WRITING ---------------- #
+
+def _write_recommendations(db, customer_ids, recommendations, product_ids, batch_size):
+    recommended = {product_ids[i] for products in recommendations for i in products}
+    names = {product["_id"]: product["name"] for product in db.products.find({"_id": {"$in": list(recommended)}}, {"name": 1})}
+
+    written = 0
+    requests = []
+    for customer_id, products in zip(customer_ids, recommendations):
+        requests.append(UpdateOne(
+            {"_id": customer_id},
+            {"$set": {"recommendedProducts": [
+                {"productName": names.get(product_ids[i]), "productID": product_ids[i]} for i in products
+            ]}}
+        ))
+        if len(requests) >= batch_size:
+            written += db.customers.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        written += db.customers.bulk_write(requests, ordered=False).modified_count
+    return written
+
+
+# ---------------- JOB ---------------- #
+
+def compute_recommendations(db, top_n=10, incremental=False, state_dir="./recommendations_state",
+                            processes=None, shard_size=50000, neighbours=50, batch_size=1000):
+    db.past_orders.create_index([("closedAt", 1), ("customerID", 1)])
+    db.past_orders.create_index("customerID")
+    run_started = datetime.datetime.now()
+
+    state = _load_state(state_dir) if incremental else None
+    if state is None:
+        # Full rebuild (also the fallback for a first incremental run)
+        baskets = _fetch_baskets(db, {"$or": [{"closedAt": {"$lte": run_started}}, {"closedAt": {"$exists": False}}]})
+        customer_ids = list(baskets)
+        # str key: ObjectIds and strings do not compare with each other
+        product_ids = sorted({product_id for basket in baskets.values() for product_id in basket["all"]}, key=str)
+        product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+        new_rows = _to_matrix(customer_ids, baskets, "all", product_index)
+        with process_pool(processes) as pool:
+            cooc = _cooccurrence(new_rows, pool, shard_size)
+    else:
+        customer_ids = _changed_customers(db, state["last_run"], run_started)
+        baskets = _fetch_baskets(db, {"customerID": {"$in": customer_ids},
+                                      "$or": [{"closedAt": {"$lte": run_started}}, {"closedAt": {"$exists": False}}]},
+                                 closed_before=state["last_run"])
+        customer_ids = [customer_id for customer_id in customer_ids if customer_id in baskets]
+
+        # Products bought for the first time get appended to the existing index
+        product_ids = state["product_ids"]
+        product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+        for basket in baskets.values():
+            for product_id in basket["all"]:
+                if product_id not in product_index:
+                    product_index[product_id] = len(product_ids)
+                    product_ids.append(product_id)
+
+        new_rows = _to_matrix(customer_ids, baskets, "all", product_index)
+        old_rows = _to_matrix(customer_ids, baskets, "old", product_index)
+        cooc = _resize(state["cooc"], len(product_ids))
+        with process_pool(processes) as pool:
+            cooc = cooc + _cooccurrence(new_rows, pool, shard_size) - _cooccurrence(old_rows, pool, shard_size)
+        cooc.eliminate_zeros()
+
+    if not customer_ids:
+        _save_state(state_dir, cooc, product_ids, run_started)
+        return {"mode": "incremental" if state else "full", "customers": 0, "products": len(product_ids), "written": 0}
+
+    similarity = _item_similarity(cooc, neighbours)
+    recommendations = []
+    with process_pool(processes, initializer=_init_scoring, initargs=(similarity, top_n)) as pool:
+        for shard_results in pool.map(_score_shard, _row_shards(new_rows, shard_size)):
+            recommendations.extend(shard_results)
+
+    written = _write_recommendations(db, customer_ids, recommendations, product_ids, batch_size)
+    _save_state(state_dir, cooc, product_ids, run_started)
+    return {
+        "mode": "incremental" if state else "full",
+        "customers": len(customer_ids),
+        "products": len(product_ids),
+        "written": written,
+    }
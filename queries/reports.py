@@ -0,0 +1,186 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+from pool_utils import process_pool
+
+# This module never touches the database: it only turns already fetched data into figures, so pool
+# workers only need this module and the data they are sent, never a connection of their own.
+
+
+# ---------------- DRAWING ---------------- #
+
+# Every drawing function creates its figures through `new_figure`. The default goes through pyplot, so
+# plt.show() displays them; the batch renderer passes a plain Figure (saved by its own Agg canvas),
+# which leaves the pyplot backend of the calling process untouched.
+def pyplot_figure(**kwargs):
+    import matplotlib.pyplot as plt
+    return plt.figure(**kwargs)
+
+def draw_inventory_by_date(data, product_id, new_figure=pyplot_figure):
+    import pandas as pd
+
+    df = pd.DataFrame(data["inventory"])
+    # Log dates are stored as dates, keep the bar labels to the day
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    df_pivot = df.pivot(index='date', columns='warehouse', values='totalInventory').fillna(0)
+
+    fig = new_figure(figsize=(12, 8))
+    ax = fig.subplots()
+    df_pivot.plot(kind='bar', ax=ax)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Total Inventory')
+    ax.set_title(f'Inventory Levels for "{data["product_name"]}" (Product ID: {product_id}) by Date and Warehouse')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend(title='Warehouse')
+    return [fig]
+
+def draw_sales_per_user(data, customer_id, new_figure=pyplot_figure):
+    import pandas as pd
+
+    df = pd.DataFrame(data)
+
+    fig = new_figure(figsize=(12, 8))
+    ax = fig.subplots()
+    # Stacking profit on top of cost
+    ax.bar(df['_id'], df['totalCost'], label='Cost', color='red')
+    ax.bar(df['_id'], df['totalProfit'], bottom=df['totalCost'], label='Profit', color='green')
+    ax.set_xlabel('Product Name')
+    ax.set_ylabel('Total in Cents')
+    ax.set_title(f'Total Cost and Profit per Item for User ID: {customer_id}')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    return [fig]
+
+def draw_sales_per_product(data, key=None, new_figure=pyplot_figure):
+    import pandas as pd
+
+    df = pd.DataFrame(data)
+
+    fig = new_figure(figsize=(12, 8))
+    ax = fig.subplots()
+    # Stacking profit on top of cost
+    ax.bar(df['_id'], df['totalCost'], label='Cost', color='red')
+    ax.bar(df['_id'], df['totalProfit'], bottom=df['totalCost'], label='Profit', color='green')
+    ax.set_xlabel('Product Name')
+    ax.set_ylabel('Total in Cents')
+    ax.set_title('Total Cost, Revenue, and Profit per Product')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend()
+    return [fig]
+
+def draw_product_stats(data, key=None, new_figure=pyplot_figure):
+    lowest_rated_products = data["lowest_rated"]
+    least_frequent_products = data["least_frequent"]
+
+    # Plot for lowest rated products
+    fig_rated = new_figure(figsize=(10, 6))
+    ax = fig_rated.subplots()
+    ax.bar([product['name'] for product in lowest_rated_products],
+           [product['avgRatingScore'] for product in lowest_rated_products],
+           color='blue')
+    ax.set_xlabel('Products')
+    ax.set_ylabel('Average Rating Score')
+    ax.set_title(f'Top {len(lowest_rated_products)} Lowest Rated Products')
+    ax.tick_params(axis='x', labelrotation=45)
+    fig_rated.tight_layout()
+
+    # Plot for least frequent products
+    fig_frequent = new_figure(figsize=(10, 6))
+    ax = fig_frequent.subplots()
+    ax.bar([product['productName'] for product in least_frequent_products],
+           [product['count'] for product in least_frequent_products],
+           color='red')
+    ax.set_xlabel('Products')
+    ax.set_ylabel('Frequency in Past Orders')
+    ax.set_title(f'Top {len(least_frequent_products)} Least Frequent Products')
+    ax.tick_params(axis='x', labelrotation=45)
+    fig_frequent.tight_layout()
+    return [fig_rated, fig_frequent]
+
+# Report kind -> drawing function, each takes (data, key, new_figure) and returns a list of figures
+DRAWERS = {
+    "inventory_by_date": draw_inventory_by_date,
+    "sales_per_user": draw_sales_per_user,
+    "sales_per_product": draw_sales_per_product,
+    "product_stats": draw_product_stats,
+}
+
+
+# ---------------- BATCH RENDERING ---------------- #
+
+def data_hash(kind, data, fmt):
+    # Same data + same report kind + same format = same picture, so the hash doubles as the cache key
+    payload = json.dumps({"kind": kind, "fmt": fmt, "data": data}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def report_paths(out_dir, kind, key, digest, fmt, n_figures):
+    safe_key = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(key))
+    base = os.path.join(out_dir, f"{kind}_{safe_key}_{digest}")
+    if n_figures == 1:
+        return [f"{base}.{fmt}"]
+    return [f"{base}_{i + 1}.{fmt}" for i in range(n_figures)]
+
+def _render_job(job):
+    # Plain Figures are not registered with pyplot: no display needed, nothing to close afterwards
+    from matplotlib.figure import Figure
+
+    kind, key, data, out_dir, fmt, digest = job
+    figures = DRAWERS[kind](data, key, new_figure=Figure)
+    paths = report_paths(out_dir, kind, key, digest, fmt, len(figures))
+    for fig, path in zip(figures, paths):
+        # Write then rename so an interrupted run never leaves a half-written file that looks cached
+        tmp_path = f"{path}.tmp"
+        fig.savefig(tmp_path, format=fmt)
+        os.replace(tmp_path, path)
+    prune_stale_reports(out_dir, kind, key, digest, fmt)
+    return kind, key, paths
+
+def prune_stale_reports(out_dir, kind, key, digest, fmt):
+    # Drop figures rendered from older data for the same report, so nightly runs do not pile up files
+    prefix = report_paths(out_dir, kind, key, "", fmt, 1)[0][:-len(f".{fmt}")]
+    pattern = re.compile(re.escape(os.path.basename(prefix)) + r"([0-9a-f]{16})(_\d+)?\." + re.escape(fmt) + "$")
+    for path in glob.glob(f"{glob.escape(prefix)}*.{fmt}"):
+        match = pattern.match(os.path.basename(path))
+        if match and match.group(1) != digest:
+            os.remove(path)
+
+# Number of figures each report kind produces, needed to look up cached files without drawing
+FIGURES_PER_KIND = {
+    "inventory_by_date": 1,
+    "sales_per_user": 1,
+    "sales_per_product": 1,
+    "product_stats": 2,
+}
+
+def render_reports(jobs, out_dir, fmt="png", processes=None, chunksize=16):
+    # jobs: iterable of (kind, key, data) tuples, data being what the fetch_* functions return
+    if fmt not in ("png", "svg"):
+        raise ValueError(f"Unsupported report format: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    summary = {"rendered": [], "cached": [], "empty": []}
+    pending = []
+    for kind, key, data in jobs:
+        if not data:
+            summary["empty"].append((kind, key))
+            continue
+        digest = data_hash(kind, data, fmt)
+        paths = report_paths(out_dir, kind, key, digest, fmt, FIGURES_PER_KIND[kind])
+        # Skip reports whose underlying data has not changed since the last run
+        if all(os.path.exists(path) for path in paths):
+            summary["cached"].append((kind, key, paths))
+            continue
+        pending.append((kind, key, data, out_dir, fmt, digest))
+
+    if not pending:
+        return summary
+
+    if processes == 1:
+        summary["rendered"].extend(map(_render_job, pending))
+    else:
+        with process_pool(processes) as pool:
+            summary["rendered"].extend(pool.map(_render_job, pending, chunksize=chunksize))
+    return summary
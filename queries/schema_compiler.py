@@ -0,0 +1,500 @@
+import datetime
+import json
+import re
+import time
+
+from bson.objectid import ObjectId
+
+# Turns db_schema.jsonc into
+#   - Python validators: one closure per schema node, built once, so validating a document is a walk
+#     over precomputed checks (no schema interpretation per document). Used by the bulk loader and
+#     the order paths before writing.
+#   - $jsonSchema collection validators for the server, from the same schema.
+#
+# Reading of the schema file:
+#   {"type": "string" | "int" | "float" | "date", "enum", "maxLength", "minimum", "maximum"}  leaf value
+#   "ObjectID()" / "ref<Collection._id>"  id or reference (the mock data uses uuid strings, so str or ObjectId)
+#   {"type": "Point", "coordinates": [...]}  GeoJSON point
+#   {"type": ["string"]} / [spec] / []  array of that spec / any array
+#   {field: spec, ...} / {}  sub-document / any object
+#   "conditional": {field: value}  the node only applies when the document has field == value. A
+#       conditional sub-document (freshAttributes, ...) must be absent or null otherwise, a conditional
+#       leaf (productType) is simply not checked.
+#   "optional": true  the field may be missing
+# Top-level fields are required unless optional or conditional; nested fields are checked when present
+# (the mock orders and tasks do not carry every field). Fields the schema does not mention are allowed.
+# "date" only accepts real dates: the expiry queries range-scan BSON dates, a string would silently drop
+# out of them. parse_dates() turns the ISO strings of the JSON files into dates before loading.
+
+COLLECTIONS = {
+    "Customers": "customers",
+    "Addresses": "addresses",
+    "PastOrders": "past_orders",
+    "Products": "products",
+    "Ratings": "ratings",
+    "ProductsInventoriesLog": "inventory_logs",
+    "Stores": "stores",
+    "Partners": "partners",
+    "CustomersOverflow": "customers_overflow",
+    "PartnersOverflow": "partners_overflow",
+    "DeliveryTasks": "delivery_tasks",
+}
+
+NODE_KEYS = ("conditional", "optional")
+
+
+# ---------------- PARSING ---------------- #
+
+def parse_jsonc(text):
+    # Drop // and /* */ comments outside of strings, then it is plain JSON
+    result, i, in_string = [], 0, False
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            result.append(char)
+            if char == "\\":
+                result.append(text[i + 1])
+                i += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            result.append(char)
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = len(text) if end == -1 else end
+            continue
+        elif text.startswith("/*", i):
+            i = text.index("*/", i) + 2
+            continue
+        else:
+            result.append(char)
+        i += 1
+    return json.loads("".join(result))
+
+def load_schema(path):
+    with open(path, 'r') as file:
+        return parse_jsonc(file.read())
+
+
+# ---------------- NODES ---------------- #
+
+def _leaf_type(spec):
+    if isinstance(spec, str):
+        return spec
+    value = spec.get("type")
+    return value if isinstance(value, str) else None
+
+def _is_id(type_name):
+    return type_name == "ObjectID()" or type_name.startswith("ref<")
+
+def _kind(spec):
+    # "leaf" | "id" | "point" | "array" | "object" | "any_object"
+    if isinstance(spec, str):
+        return "id" if _is_id(spec) else "leaf"
+    if isinstance(spec, list):
+        return "array"
+    type_value = spec.get("type")
+    if type_value == "Point":
+        return "point"
+    if isinstance(type_value, list):
+        return "array"
+    if isinstance(type_value, str):
+        return "id" if _is_id(type_value) else "leaf"
+    return "object" if any(key not in NODE_KEYS for key in spec) else "any_object"
+
+def _array_item(spec):
+    if isinstance(spec, list):
+        return spec[0] if spec else None
+    return {"type": spec["type"][0]}
+
+def _fields(spec):
+    return [(key, value) for key, value in spec.items() if key not in NODE_KEYS]
+
+def _required(key, spec):
+    # _id is added by the server when missing, conditional fields only exist for some documents
+    return key != "_id" and not (isinstance(spec, dict) and (spec.get("optional") or spec.get("conditional")))
+
+
+# ---------------- PYTHON VALIDATORS ---------------- #
+
+def _compile_leaf(spec, path):
+    type_name = _leaf_type(spec)
+    enum = frozenset(spec["enum"]) if isinstance(spec, dict) and "enum" in spec else None
+    max_length = spec.get("maxLength") if isinstance(spec, dict) else None
+    minimum = spec.get("minimum") if isinstance(spec, dict) else None
+    maximum = spec.get("maximum") if isinstance(spec, dict) else None
+
+    if type_name == "string":
+        def check(value, root):
+            if value.__class__ is not str:
+                return f"{path}: expected string, got {type(value).__name__}"
+            if max_length is not None and len(value) > max_length:
+                return f"{path}: longer than {max_length} characters"
+            if enum is not None and value not in enum:
+                return f"{path}: {value!r} not in {sorted(enum)}"
+            return None
+    elif type_name in ("int", "float"):
+        accepted = (int,) if type_name == "int" else (int, float)
+
+        def check(value, root):
+            # bool is an int subclass, but never a valid number here
+            if not isinstance(value, accepted) or value.__class__ is bool:
+                return f"{path}: expected {type_name}, got {type(value).__name__}"
+            if minimum is not None and value < minimum:
+                return f"{path}: {value} below minimum {minimum}"
+            if maximum is not None and value > maximum:
+                return f"{path}: {value} above maximum {maximum}"
+            if enum is not None and value not in enum:
+                return f"{path}: {value!r} not in {sorted(enum)}"
+            return None
+    elif type_name == "date":
+        def check(value, root):
+            if value.__class__ is not datetime.datetime:
+                return f"{path}: expected date, got {value!r}"
+            return None
+    else:
+        raise ValueError(f"{path}: unknown type {type_name!r}")
+    return check
+
+def _compile_id(path):
+    def check(value, root):
+        if value.__class__ is not str and value.__class__ is not ObjectId:
+            return f"{path}: expected id (string or ObjectId), got {type(value).__name__}"
+        return None
+    return check
+
+def _compile_point(path):
+    def check(value, root):
+        if value.__class__ is not dict or value.get("type") != "Point":
+            return f"{path}: expected GeoJSON Point"
+        coordinates = value.get("coordinates")
+        if (coordinates.__class__ is not list or len(coordinates) != 2
+                or not all(isinstance(c, (int, float)) and c.__class__ is not bool for c in coordinates)):
+            return f"{path}: coordinates must be [lon, lat]"
+        if not (-180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90):
+            return f"{path}: coordinates out of range"
+        return None
+    return check
+
+def _compile_array(spec, path):
+    item = _array_item(spec)
+    item_check = _compile_node(item, f"{path}[]") if item is not None else None
+
+    def check(value, root):
+        if value.__class__ is not list:
+            return f"{path}: expected array, got {type(value).__name__}"
+        if item_check is not None:
+            for element in value:
+                if element is not None:
+                    error = item_check(element, root)
+                    if error:
+                        return error
+        return None
+    return check
+
+def _compile_object(spec, path, top_level=False):
+    checks = []
+    required = []
+    for key, field_spec in _fields(spec):
+        field_path = f"{path}.{key}" if path else key
+        checks.append((key, _compile_node(field_spec, field_path)))
+        if top_level and _required(key, field_spec):
+            required.append(key)
+    checks = tuple(checks)
+    required = frozenset(required)
+    label = path or "document"
+
+    def check(value, root):
+        if value.__class__ is not dict:
+            return f"{label}: expected object, got {type(value).__name__}"
+        if not required <= value.keys():
+            return f"{label}: missing {', '.join(sorted(required - value.keys()))}"
+        for key, field_check in checks:
+            # Null stands for "not set" (the mock data writes unset attributes as null)
+            field_value = value.get(key)
+            if field_value is None:
+                continue
+            error = field_check(field_value, root)
+            if error:
+                return error
+        return None
+    return check
+
+def _compile_any_object(path):
+    def check(value, root):
+        if value.__class__ is not dict:
+            return f"{path}: expected object, got {type(value).__name__}"
+        return None
+    return check
+
+def _compile_node(spec, path):
+    kind = _kind(spec)
+    if kind == "leaf":
+        check = _compile_leaf(spec, path)
+    elif kind == "id":
+        check = _compile_id(path)
+    elif kind == "point":
+        check = _compile_point(path)
+    elif kind == "array":
+        check = _compile_array(spec, path)
+    elif kind == "object":
+        check = _compile_object(spec, path)
+    else:
+        check = _compile_any_object(path)
+
+    inner = check
+    conditional = spec.get("conditional") if isinstance(spec, dict) else None
+    if not conditional:
+        return check
+
+    conditions = tuple(conditional.items())
+    exclusive = kind in ("object", "any_object")
+    condition_text = ", ".join(f"{key} == {value!r}" for key, value in conditions)
+
+    def check(value, root):
+        if all(root.get(key) == expected for key, expected in conditions):
+            return None if value is None else inner(value, root)
+        if exclusive and value is not None:
+            return f"{path}: only allowed when {condition_text}"
+        return None
+    return check
+
+
+# ---------------- DATE PARSING ---------------- #
+
+def _parse_date(value):
+    if value.__class__ is str:
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            # Left as is, the validator reports it
+            return value
+    return value
+
+def _compile_date_parser(spec):
+    # Function turning the ISO strings under `spec` into datetimes in place (returns the new value),
+    # None when no date lives under it
+    kind = _kind(spec)
+    if kind == "leaf":
+        return _parse_date if _leaf_type(spec) == "date" else None
+    if kind == "array":
+        item = _array_item(spec)
+        item_parser = _compile_date_parser(item) if item is not None else None
+        if item_parser is None:
+            return None
+
+        def parse(value):
+            if value.__class__ is list:
+                value[:] = [item_parser(element) if element is not None else None for element in value]
+            return value
+        return parse
+    if kind == "object":
+        parsers = [(key, parser) for key, parser in
+                   ((key, _compile_date_parser(field_spec)) for key, field_spec in _fields(spec)) if parser]
+        if not parsers:
+            return None
+
+        def parse(value):
+            if value.__class__ is dict:
+                for key, parser in parsers:
+                    if value.get(key) is not None:
+                        value[key] = parser(value[key])
+            return value
+        return parse
+    return None
+
+
+class CollectionValidator:
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+        self._check = _compile_object(spec, "", top_level=True)
+        self._parse_dates = _compile_date_parser(spec)
+        self._elements = {}
+
+    def parse_dates(self, document):
+        # ISO date strings (JSON files) -> datetimes, in place, wherever the schema says "date"
+        if self._parse_dates is not None:
+            self._parse_dates(document)
+        return document
+
+    def __call__(self, document):
+        # First problem found as "path: reason", None when the document is valid
+        return self._check(document, document)
+
+    def element(self, field):
+        # Validator for one element of a top-level array field (i.e. a new currentOrders entry),
+        # to check it before $push-ing it into an existing document
+        if field not in self._elements:
+            item = _array_item(self.spec[field])
+            item_check = _compile_node(item, f"{field}[]")
+            self._elements[field] = lambda value: item_check(value, value)
+        return self._elements[field]
+
+    def invalid(self, documents):
+        # [(position, error)] for the documents that do not validate
+        check = self._check
+        errors = []
+        for i, document in enumerate(documents):
+            error = check(document, document)
+            if error:
+                errors.append((i, error))
+        return errors
+
+def compile_schema(schema):
+    return {COLLECTIONS[name]: CollectionValidator(COLLECTIONS[name], spec)
+            for name, spec in schema.items() if name in COLLECTIONS}
+
+def load_validators(path):
+    return compile_schema(load_schema(path))
+
+
+# ---------------- $jsonSchema ---------------- #
+
+def _type_keyword(bson, bson_types, json_types):
+    if bson:
+        return {"bsonType": bson_types}
+    return {"type": json_types}
+
+def _json_node(spec, bson):
+    kind = _kind(spec)
+    if kind == "id":
+        node = _type_keyword(bson, ["string", "objectId"], "string")
+    elif kind == "point":
+        node = {**_type_keyword(bson, "object", "object"),
+                "required": ["type", "coordinates"],
+                "properties": {
+                    "type": {"enum": ["Point"]},
+                    "coordinates": {**_type_keyword(bson, "array", "array"), "minItems": 2, "maxItems": 2,
+                                    "items": _type_keyword(bson, ["double", "int", "long", "decimal"], "number")}
+                }}
+    elif kind == "array":
+        node = _type_keyword(bson, "array", "array")
+        item = _array_item(spec)
+        if item is not None:
+            node["items"] = _json_node(item, bson)
+    elif kind == "object":
+        node = {**_type_keyword(bson, "object", "object"),
+                "properties": {key: _json_node(value, bson) for key, value in _fields(spec)}}
+    elif kind == "any_object":
+        node = _type_keyword(bson, "object", "object")
+    else:
+        type_name = _leaf_type(spec)
+        if type_name == "string":
+            node = _type_keyword(bson, "string", "string")
+        elif type_name == "int":
+            node = _type_keyword(bson, ["int", "long"], "integer")
+        elif type_name == "float":
+            node = _type_keyword(bson, ["double", "int", "long", "decimal"], "number")
+        else:
+            # "date" is not a JSON type: benchmark_validators registers it with the jsonschema library
+            node = _type_keyword(bson, "date", "date")
+        for keyword in ("enum", "maxLength", "minimum", "maximum"):
+            if keyword in spec:
+                node[keyword] = spec[keyword]
+
+    # Unset attributes are written as null
+    if "bsonType" in node:
+        node["bsonType"] = [*(node["bsonType"] if isinstance(node["bsonType"], list) else [node["bsonType"]]), "null"]
+    else:
+        node["type"] = [*(node["type"] if isinstance(node["type"], list) else [node["type"]]), "null"]
+    if "enum" in node:
+        node["enum"] = [*node["enum"], None]
+    return node
+
+def _nested(path, node):
+    # {"properties": {a: {"properties": {b: node}}}} for path [a, b]
+    for key in reversed(path):
+        node = {"properties": {key: node}}
+    return node
+
+def _conditional_rules(spec, path, bson, rules):
+    # $jsonSchema has no if/then: "condition holds and the node matches, or it does not and the node is
+    # absent/null (sub-documents) / anything (leaves)" is written as an anyOf at the top level
+    for key, value in _fields(spec) if _kind(spec) == "object" else ():
+        node_path = path + [key]
+        if isinstance(value, dict) and value.get("conditional"):
+            condition = {"required": list(value["conditional"]),
+                         "properties": {field: {"enum": [expected]} for field, expected in value["conditional"].items()}}
+            # Conditional nodes nested in this one get their own rule
+            node = _json_node(_strip_conditionals(value) if _kind(value) == "object" else value, bson)
+            otherwise = _nested(node_path, _type_keyword(bson, "null", "null")) if _kind(value) in ("object", "any_object") else {}
+            rules.append({"anyOf": [
+                {"allOf": [condition, _nested(node_path, node)]},
+                {"allOf": [{"not": condition}, otherwise]},
+            ]})
+        if isinstance(value, dict):
+            _conditional_rules(value, node_path, bson, rules)
+
+def _strip_conditionals(spec):
+    # The conditional nodes are checked through the top-level rules only
+    if not isinstance(spec, dict) or _kind(spec) != "object":
+        return spec
+    return {key: _strip_conditionals(value) for key, value in spec.items()
+            if key not in NODE_KEYS and not (isinstance(value, dict) and value.get("conditional"))}
+
+def json_schema(spec, bson=True):
+    root = _json_node(_strip_conditionals(spec), bson)
+    root.pop("bsonType" if bson else "type")
+    root["bsonType" if bson else "type"] = "object"
+    root["required"] = [key for key, value in _fields(spec) if _required(key, value)]
+    rules = []
+    _conditional_rules(spec, [], bson, rules)
+    if rules:
+        root["allOf"] = rules
+    return root
+
+def apply_server_validators(db, schema, level="moderate", action="error"):
+    # Install the $jsonSchema validators; "moderate" leaves already stored invalid documents alone
+    existing = set(db.list_collection_names())
+    for name, spec in schema.items():
+        if name not in COLLECTIONS:
+            continue
+        collection = COLLECTIONS[name]
+        options = {"validator": {"$jsonSchema": json_schema(spec)},
+                   "validationLevel": level, "validationAction": action}
+        if collection in existing:
+            db.command("collMod", collection, **options)
+        else:
+            db.create_collection(collection, **options)
+
+
+# ---------------- BENCHMARK ---------------- #
+
+def benchmark_validators(schema, documents_by_collection, copies=1000):
+    # Documents validated per second by the compiled validators and by the jsonschema library
+    # (optional dependency, only needed here) on the same documents, dates parsed like the loader does
+    import jsonschema
+
+    validators = compile_schema(schema)
+    # "date" is a custom type in the generated JSON Schema
+    type_checker = jsonschema.Draft7Validator.TYPE_CHECKER.redefine(
+        "date", lambda checker, value: isinstance(value, datetime.datetime))
+    Validator = jsonschema.validators.extend(jsonschema.Draft7Validator, type_checker=type_checker)
+    results = {}
+    for collection, documents in documents_by_collection.items():
+        if not documents or collection not in validators:
+            continue
+        name = next(name for name, value in COLLECTIONS.items() if value == collection)
+        documents = [validators[collection].parse_dates(document) for document in documents] * copies
+
+        started = time.perf_counter()
+        compiled_errors = len(validators[collection].invalid(documents))
+        compiled_seconds = time.perf_counter() - started
+
+        library = Validator(json_schema(schema[name], bson=False))
+        sample = documents[:max(len(documents) // 20, 1)]  # the library is far slower, time a slice
+        started = time.perf_counter()
+        library_errors = sum(0 if library.is_valid(document) else 1 for document in sample)
+        library_seconds = time.perf_counter() - started
+
+        results[collection] = {
+            "documents": len(documents),
+            "compiled_docs_per_s": len(documents) / compiled_seconds,
+            "jsonschema_docs_per_s": len(sample) / library_seconds,
+            "compiled_invalid": compiled_errors,
+            "jsonschema_invalid_in_sample": library_errors,
+        }
+    return results